@@ -12,9 +12,10 @@
 # request. The configuration at the top should be enough to adapt to other
 # portals (URL, form selector, and required fields).
 
+import logging
 import sys
 
-from captive_portal import CaptivePortalClient
+from connectivity import has_internet_fast
 
 ### CONFIGURATION (edit for other portals) ###
 PROBE_URL = "http://connectivitycheck.gstatic.com/generate_204"
@@ -28,6 +29,10 @@ PORTAL_FALLBACK_URL = (
 FORM_ID = "loginForm"
 FORM_ACTION_CONTAINS = "/api/v4/login"
 
+# Post straight to this URL and only parse the portal form if that fails.
+SUBMIT_URL_TEMPLATE = "https://hotspot.vodafone.de/api/v4/login"
+SUBMIT_METHOD = "get"
+
 DEFAULT_FORM_FIELDS = {
     "loginProfile": "6",
     "accessType": "termsOnly",
@@ -39,8 +44,18 @@ QUERY_FIELDS_FROM_PORTAL_URL = ["sessionID"]
 
 REQUEST_TIMEOUT = 10
 
+logger = logging.getLogger(__name__)
+
 
 def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+    if has_internet_fast(PROBE_URL, PROBE_EXPECTED_STATUS, REQUEST_TIMEOUT):
+        logger.info("DONE: Internet is reachable. Nothing to do.")
+        return 0
+
+    from captive_portal import CaptivePortalClient
+
     client = CaptivePortalClient(
         probe_url=PROBE_URL,
         probe_expected_status=PROBE_EXPECTED_STATUS,
@@ -50,8 +65,10 @@ def main() -> int:
         default_form_fields=DEFAULT_FORM_FIELDS,
         query_fields_from_url=QUERY_FIELDS_FROM_PORTAL_URL,
         request_timeout=REQUEST_TIMEOUT,
+        submit_url_template=SUBMIT_URL_TEMPLATE,
+        submit_method=SUBMIT_METHOD,
     )
-    return client.login()
+    return client.login(probe_first=False)
 
 
 if __name__ == "__main__":
@@ -3,48 +3,134 @@
 
 from __future__ import annotations
 
+import contextlib
+import functools
+import logging
+import re
+import socket
+import threading
 import urllib.parse
+from concurrent.futures import Future, wait
 from html.parser import HTMLParser
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover - lxml is optional
+    etree = None
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Dict, Iterator, List, Optional, Pattern, Protocol, Tuple
+
+    class CachedResolver(Protocol):
+        def __call__(self, *args: Any, **kwargs: Any) -> list: ...
+
+        def cache_clear(self) -> None: ...
+
+logger = logging.getLogger(__name__)
+
+# Head start the probe gets before the fallback portal page is requested too.
+PORTAL_FALLBACK_DELAY = 0.2
+
+PORTAL_CHUNK_SIZE = 4096
+
+# Once the form is found, bodies up to this size are still read to the end:
+# closing a half-read response drops the keep-alive connection to the portal.
+PORTAL_DRAIN_LIMIT = 64 * 1024
+
+# Only these tags carry form state; every other start tag is skipped early.
+_FORM_TAGS = frozenset({"form", "input", "button"})
+_SUBMIT_TYPES = frozenset({"submit", "button"})
+_HTML_CONTENT_TYPES = frozenset({"text/html", "application/xhtml+xml"})
+
+
+@contextlib.contextmanager
+def cached_dns(maxsize: int = 32) -> Iterator[CachedResolver]:
+    """Memoize socket.getaddrinfo while the block runs.
+
+    The returned function exposes ``cache_clear()``; call it once the portal
+    login went through, since captive portals often answer DNS with their own
+    address until the client is logged in. Pooled connections opened with
+    those answers have to be dropped as well.
+    """
+    original = socket.getaddrinfo
+    cached = functools.lru_cache(maxsize=maxsize)(original)
+    socket.getaddrinfo = cached
+    try:
+        yield cached
+    finally:
+        socket.getaddrinfo = original
+
+
+def compile_marker(marker: Optional[str]) -> Optional[Pattern[str]]:
+    marker = (marker or "").strip()
+    if not marker:
+        return None
+    return re.compile(re.escape(marker), re.IGNORECASE)
 
 
 class CaptivePortalFormParser(HTMLParser):
+    __slots__ = (
+        "form_id",
+        "action_contains",
+        "button_text_contains",
+        "_button_re",
+        "active_form",
+        "active_form_index",
+        "forms",
+        "inputs",
+        "form_submit_match",
+        "capture_button_text_for_form",
+        "_button_text",
+        "_form_counter",
+        "done",
+    )
+
     def __init__(
         self,
         form_id: Optional[str],
         action_contains: Optional[str],
         button_text_contains: Optional[str] = None,
     ) -> None:
-        super().__init__()
         self.form_id = form_id
         self.action_contains = action_contains
         self.button_text_contains = (button_text_contains or "").lower().strip()
+        self._button_re = compile_marker(button_text_contains)
+        super().__init__()
+
+    def reset(self) -> None:
+        """Clear all parsed state so the instance can parse another page."""
+        super().reset()
         self.active_form: Optional[Dict[str, Optional[str]]] = None
         self.active_form_index: Optional[int] = None
         self.forms: List[Dict[str, Optional[str]]] = []
-        self.inputs: Dict[int, Dict[str, str]] = {}
-        self.form_submit_match: Dict[int, bool] = {}
+        self.inputs: List[Dict[str, str]] = []
+        self.form_submit_match: List[bool] = []
         self.capture_button_text_for_form: Optional[int] = None
+        self._button_text: List[str] = []
         self._form_counter = 0
+        self.done = False
 
     def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
-        attrs_dict: Dict[str, Optional[str]] = {key: value for key, value in attrs if key}
+        if tag not in _FORM_TAGS:
+            return
+        attrs_dict: Dict[str, Optional[str]] = dict(attrs)
+        attrs_dict.pop("", None)
 
         if tag == "form":
             if self._matches_form(attrs_dict):
                 self.active_form = attrs_dict
                 self.active_form_index = self._form_counter
                 self.forms.append(attrs_dict)
-                self.inputs[self._form_counter] = {}
-                self.form_submit_match[self._form_counter] = False
+                self.inputs.append({})
+                self.form_submit_match.append(False)
                 self._form_counter += 1
             return
 
-        if tag == "form" and self.active_form is not None:
-            return
-
         if tag == "button" and self.active_form is not None:
             button_type = (attrs_dict.get("type") or "submit").lower()
             if button_type == "submit":
@@ -55,33 +141,45 @@ class CaptivePortalFormParser(HTMLParser):
             name = attrs_dict.get("name")
             value = attrs_dict.get("value") or ""
             input_type = (attrs_dict.get("type") or "").lower()
-            if input_type in {"submit", "button"}:
+            if input_type in _SUBMIT_TYPES:
                 self._mark_submit_match(value)
             if name and input_type != "submit":
                 self.inputs[self._form_counter - 1][name] = value
 
     def handle_endtag(self, tag: str) -> None:
         if tag == "button":
-            self.capture_button_text_for_form = None
+            self._finish_button()
             return
         if tag == "form":
-            self.capture_button_text_for_form = None
+            self._finish_button()
+            # The first matching form (with a matching button, if required)
+            # is the one that gets submitted, so the rest of the page is moot.
+            index = self.active_form_index
+            if index is not None and (not self.button_text_contains or self.form_submit_match[index]):
+                self.done = True
             self.active_form = None
             self.active_form_index = None
 
     def handle_data(self, data: str) -> None:
         if self.capture_button_text_for_form is None:
             return
-        self._mark_submit_match(data, self.capture_button_text_for_form)
+        # Button text may arrive in several pieces when the page is fed in chunks.
+        self._button_text.append(data)
+
+    def _finish_button(self) -> None:
+        if self.capture_button_text_for_form is not None and self._button_text:
+            self._mark_submit_match("".join(self._button_text), self.capture_button_text_for_form)
+        self._button_text.clear()
+        self.capture_button_text_for_form = None
 
     def _mark_submit_match(self, text: str, form_index: Optional[int] = None) -> None:
-        if not self.button_text_contains:
+        if self._button_re is None:
             return
         if form_index is None:
             form_index = self.active_form_index
         if form_index is None:
             return
-        if self.button_text_contains in text.lower():
+        if self._button_re.search(text):
             self.form_submit_match[form_index] = True
 
     def _matches_form(self, attrs_dict: Dict[str, Optional[str]]) -> bool:
@@ -92,24 +190,189 @@ class CaptivePortalFormParser(HTMLParser):
         return False
 
 
+class LxmlCaptivePortalFormParser(CaptivePortalFormParser):
+    """Drives the form state machine from libxml2's incremental HTML parser."""
+
+    __slots__ = ("_pull",)
+
+    def reset(self) -> None:
+        super().reset()
+        self._pull = etree.HTMLPullParser(events=("start", "end"))
+
+    def feed(self, data: str) -> None:
+        self._pull.feed(data)
+        self._process_events()
+
+    def close(self) -> None:
+        try:
+            self._pull.close()
+        except etree.XMLSyntaxError:
+            # libxml2 refuses to close a document that was never fed any data.
+            return
+        self._process_events()
+
+    def _process_events(self) -> None:
+        for event, elem in self._pull.read_events():
+            tag = elem.tag
+            if not isinstance(tag, str):
+                continue
+            if event == "start":
+                if tag in _FORM_TAGS:
+                    self.handle_starttag(tag, elem.items())
+                continue
+            if tag == "button" and self.capture_button_text_for_form is not None:
+                self.handle_data("".join(elem.itertext()))
+            self.handle_endtag(tag)
+            # Keep button children around until the button text has been read.
+            if self.capture_button_text_for_form is None:
+                elem.clear()
+
+
+def create_form_parser(
+    form_id: Optional[str],
+    action_contains: Optional[str],
+    button_text_contains: Optional[str] = None,
+    use_lxml: bool = False,
+) -> CaptivePortalFormParser:
+    """Build a form parser, using lxml only when asked to and installed.
+
+    libxml2 closes a form as soon as an enclosing element ends, while
+    html.parser (like browsers) keeps collecting inputs until </form>, so
+    the lxml parser is opt-in for portals whose markup is well nested.
+    """
+    if use_lxml and etree is not None:
+        return LxmlCaptivePortalFormParser(form_id, action_contains, button_text_contains)
+    return CaptivePortalFormParser(form_id, action_contains, button_text_contains)
+
+
 def has_internet(session: requests.Session, probe_url: str, expected_status: int, timeout: int) -> bool:
     try:
-        response = session.get(probe_url, timeout=timeout, allow_redirects=False)
+        response = session.head(probe_url, timeout=timeout, allow_redirects=False)
+        if response.status_code == 405:
+            response = session.get(probe_url, timeout=timeout, allow_redirects=False)
     except requests.RequestException:
         return False
     return response.status_code == expected_status
 
 
-def fetch_portal_page(session: requests.Session, probe_url: str, fallback_url: str, timeout: int) -> Tuple[str, str]:
+def is_html_response(response: requests.Response) -> bool:
+    content_type = response.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+    return content_type in _HTML_CONTENT_TYPES
+
+
+def read_portal_body(response: requests.Response, parser: Optional[CaptivePortalFormParser] = None) -> str:
+    """Read a streamed response, feeding the parser as chunks arrive.
+
+    After the parser has seen the login form the rest is only downloaded
+    while the page stays below PORTAL_DRAIN_LIMIT.
+    """
+    if response.encoding is None:
+        response.encoding = "utf-8"
+    chunks: List[str] = []
+    size = 0
+    try:
+        for raw_chunk in response.iter_content(PORTAL_CHUNK_SIZE, decode_unicode=True):
+            # Always str once an encoding is set; bytes only satisfies the type.
+            if isinstance(raw_chunk, bytes):
+                chunk = raw_chunk.decode(response.encoding or "utf-8", "replace")
+            else:
+                chunk = raw_chunk
+            chunks.append(chunk)
+            size += len(chunk)
+            if parser is None:
+                continue
+            if not parser.done:
+                parser.feed(chunk)
+            elif size > PORTAL_DRAIN_LIMIT:
+                break
+    finally:
+        response.close()
+    return "".join(chunks)
+
+
+def _run_in_background(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """Run ``func`` on a daemon thread.
+
+    A request that lost the race cannot be cancelled, but a daemon thread
+    at least does not keep the process alive until it times out.
+    """
+    future: Future = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _close_when_done(future: Future) -> None:
+    def close(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            done.result().close()
+
+    future.add_done_callback(close)
+
+
+def _isolated_session(session: requests.Session) -> requests.Session:
+    """Copy of ``session`` with its own cookie jar but the same connection pools."""
+    isolated = requests.Session()
+    isolated.headers.update(session.headers)
+    isolated.cookies.update(session.cookies)
+    for prefix, adapter in session.adapters.items():
+        isolated.mount(prefix, adapter)
+    return isolated
+
+
+def _close_parser(parser: Optional[CaptivePortalFormParser]) -> None:
+    if parser is not None and not parser.done:
+        parser.close()
+
+
+def fetch_portal_page(
+    session: requests.Session,
+    probe_url: str,
+    fallback_url: str,
+    timeout: int,
+    parser: Optional[CaptivePortalFormParser] = None,
+) -> Tuple[str, str]:
+    # The fallback page keeps its cookies to itself until it is actually
+    # used, so it cannot clobber the portal session set up by the probe.
+    fallback_session = _isolated_session(session)
+    probe = _run_in_background(session.get, probe_url, timeout=timeout, allow_redirects=True, stream=True)
+    # Only speculate on the fallback if the probe is slow; the redirected
+    # probe still wins because it carries the portal's session parameters.
+    fallback = None
+    if not wait([probe], timeout=PORTAL_FALLBACK_DELAY).done:
+        fallback = _run_in_background(fallback_session.get, fallback_url, timeout=timeout, stream=True)
+
     try:
-        response = session.get(probe_url, timeout=timeout, allow_redirects=True)
-        if response.text and "text/html" in response.headers.get("Content-Type", ""):
-            return response.url, response.text
+        response = probe.result()
+        if is_html_response(response):
+            html = read_portal_body(response, parser)
+            if html:
+                if fallback is not None:
+                    _close_when_done(fallback)
+                _close_parser(parser)
+                return response.url, html
+        else:
+            response.close()
     except requests.RequestException:
-        pass
+        if parser is not None:
+            parser.reset()
 
-    response = session.get(fallback_url, timeout=timeout)
-    return response.url, response.text
+    if fallback is None:
+        response = fallback_session.get(fallback_url, timeout=timeout, stream=True)
+    else:
+        response = fallback.result()
+    session.cookies.update(fallback_session.cookies)
+    html = read_portal_body(response, parser)
+    _close_parser(parser)
+    return response.url, html
 
 
 def parse_login_form(
@@ -117,9 +380,18 @@ def parse_login_form(
     form_id: Optional[str],
     form_action_contains: Optional[str],
     button_text_contains: Optional[str] = None,
+    parser: Optional[CaptivePortalFormParser] = None,
+    use_lxml: bool = False,
 ) -> Tuple[Dict[str, str], Dict[str, str]]:
-    parser = CaptivePortalFormParser(form_id, form_action_contains, button_text_contains)
-    parser.feed(html)
+    """Pick the login form out of the portal page.
+
+    A parser that was already fed while the page was downloading (see
+    fetch_portal_page) is used as is; otherwise ``html`` is parsed here.
+    """
+    if parser is None:
+        parser = create_form_parser(form_id, form_action_contains, button_text_contains, use_lxml)
+        parser.feed(html)
+        parser.close()
 
     if not parser.forms:
         raise RuntimeError("No matching login form found in portal HTML.")
@@ -127,7 +399,7 @@ def parse_login_form(
     selected_index = 0
     if parser.button_text_contains:
         matching_indices = [
-            idx for idx, matches in parser.form_submit_match.items() if matches
+            idx for idx, matches in enumerate(parser.form_submit_match) if matches
         ]
         if not matching_indices:
             raise RuntimeError(
@@ -137,13 +409,12 @@ def parse_login_form(
 
     form_attrs_raw = parser.forms[selected_index]
     form_attrs: Dict[str, str] = {k: v for k, v in form_attrs_raw.items() if v is not None}
-    form_inputs = parser.inputs.get(selected_index, {})
+    form_inputs = parser.inputs[selected_index]
     return form_attrs, form_inputs
 
 
-def portal_indicates_online(html: str, marker: str) -> bool:
-    marker = marker.strip().lower()
-    return bool(marker) and marker in html.lower()
+def portal_indicates_online(html: str, marker: Optional[Pattern[str]]) -> bool:
+    return marker is not None and marker.search(html) is not None
 
 
 def merge_form_data(
@@ -152,18 +423,21 @@ def merge_form_data(
     extra_fields: Dict[str, str],
     query_fields: List[str],
 ) -> Dict[str, str]:
-    payload = {key: value for key, value in form_inputs.items() if key}
-
-    parsed_url = urllib.parse.urlparse(portal_url)
-    portal_query = urllib.parse.parse_qs(parsed_url.query)
-    for field in query_fields:
-        if field not in payload and field in portal_query:
-            payload[field] = portal_query[field][0]
+    form_fields = {key: value for key, value in form_inputs.items() if key}
 
-    for key, value in extra_fields.items():
-        payload.setdefault(key, value)
+    query_defaults: Dict[str, str] = {}
+    wanted = set(query_fields).difference(form_fields)
+    if wanted:
+        query = urllib.parse.urlsplit(portal_url).query
+        for key, value in urllib.parse.parse_qsl(query):
+            if key in wanted:
+                query_defaults[key] = value
+                wanted.discard(key)
+                if not wanted:
+                    break
 
-    return payload
+    # Later sources win: form inputs, then portal query, then configured defaults.
+    return {**extra_fields, **query_defaults, **form_fields}
 
 
 def submit_login_form(
@@ -176,7 +450,10 @@ def submit_login_form(
     action = form_attrs.get("action", "").rstrip("?")
     method = form_attrs.get("method", "get").lower()
 
-    submit_url = urllib.parse.urljoin(portal_url, action)
+    if action.startswith(("http://", "https://")):
+        submit_url = action
+    else:
+        submit_url = urllib.parse.urljoin(portal_url, action)
     if method == "post":
         return session.post(submit_url, data=payload, timeout=timeout)
     return session.get(submit_url, params=payload, timeout=timeout)
@@ -195,6 +472,9 @@ class CaptivePortalClient:
         default_form_fields: Optional[Dict[str, str]] = None,
         query_fields_from_url: Optional[List[str]] = None,
         request_timeout: int = 10,
+        submit_url_template: Optional[str] = None,
+        submit_method: str = "post",
+        use_lxml: bool = False,
     ):
         self.probe_url = probe_url
         self.probe_expected_status = probe_expected_status
@@ -203,28 +483,55 @@ class CaptivePortalClient:
         self.form_action_contains = form_action_contains
         self.button_text_contains = button_text_contains
         self.already_online_marker = already_online_marker
+        self._online_re = compile_marker(already_online_marker)
         self.default_form_fields = default_form_fields or {}
         self.query_fields_from_url = query_fields_from_url or []
         self.request_timeout = request_timeout
+        self.submit_url_template = submit_url_template
+        self.submit_method = submit_method
+        self.use_lxml = use_lxml
+        self._session = self._create_session()
+        self._parser = self.create_parser()
+
+    @staticmethod
+    def _create_session() -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=8,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+        return session
 
     def check_internet(self, session: requests.Session) -> bool:
         return has_internet(session, self.probe_url, self.probe_expected_status, self.request_timeout)
 
-    def fetch_portal(self, session: requests.Session) -> Tuple[str, str]:
-        return fetch_portal_page(session, self.probe_url, self.portal_fallback_url, self.request_timeout)
+    def fetch_portal(self, session: requests.Session, parser: Optional[CaptivePortalFormParser] = None) -> Tuple[str, str]:
+        return fetch_portal_page(session, self.probe_url, self.portal_fallback_url, self.request_timeout, parser)
 
-    def parse_form(self, html: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    def create_parser(self) -> CaptivePortalFormParser:
+        return create_form_parser(
+            self.form_id,
+            self.form_action_contains,
+            self.button_text_contains,
+            self.use_lxml,
+        )
+
+    def parse_form(self, html: str, parser: Optional[CaptivePortalFormParser] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
         return parse_login_form(
             html,
             self.form_id,
             self.form_action_contains,
             self.button_text_contains,
+            parser,
+            self.use_lxml,
         )
 
     def is_online_page(self, html: str) -> bool:
-        if not self.already_online_marker:
-            return False
-        return portal_indicates_online(html, self.already_online_marker)
+        return portal_indicates_online(html, self._online_re)
 
     def build_payload(self, form_inputs: Dict[str, str], portal_url: str) -> Dict[str, str]:
         return merge_form_data(
@@ -237,32 +544,73 @@ class CaptivePortalClient:
     def submit(self, session: requests.Session, portal_url: str, form_attrs: Dict[str, str], payload: Dict[str, str]) -> requests.Response:
         return submit_login_form(session, portal_url, form_attrs, payload, self.request_timeout)
 
-    def login(self) -> int:
-        session = requests.Session()
-
-        if self.check_internet(session):
-            print("DONE: Internet is reachable. Nothing to do.")
+    def _fast_submit(self, session: requests.Session, portal_url: str) -> requests.Response:
+        form_attrs = {"action": self.submit_url_template or "", "method": self.submit_method}
+        payload = self.build_payload({}, portal_url)
+        return self.submit(session, portal_url, form_attrs, payload)
+
+    @staticmethod
+    def _forget_prelogin_routes(session: requests.Session, resolver: CachedResolver) -> None:
+        # Before login the portal may have answered DNS for the probe host, so
+        # neither the cached addresses nor sockets opened with them are reused.
+        resolver.cache_clear()
+        session.close()
+
+    def login(self, probe_first: bool = True) -> int:
+        """Log in through the captive portal if the internet is not reachable.
+
+        Pass ``probe_first=False`` when the caller has already found the
+        connection to be blocked.
+        """
+        with cached_dns() as resolver:
+            return self._login(self._session, resolver, probe_first)
+
+    def _login(self, session: requests.Session, resolver: CachedResolver, probe_first: bool) -> int:
+        if probe_first and self.check_internet(session):
+            logger.info("DONE: Internet is reachable. Nothing to do.")
             return 0
 
-        print("Internet not reachable. Attempting captive portal login ...")
-        portal_url, portal_html = self.fetch_portal(session)
+        logger.info("Internet not reachable. Attempting captive portal login ...")
+        # With a direct submit URL the form is only needed if that fails, so
+        # the page is parsed afterwards instead of while it downloads.
+        parser: Optional[CaptivePortalFormParser] = None
+        if not self.submit_url_template:
+            parser = self._parser
+            parser.reset()
+        portal_url, portal_html = self.fetch_portal(session, parser)
 
         if self.is_online_page(portal_html):
-            print("DONE: Portal shows already online page. Treating connection as online.")
+            logger.info("DONE: Portal shows already online page. Treating connection as online.")
             return 0
 
-        form_attrs, form_inputs = self.parse_form(portal_html)
+        if self.submit_url_template:
+            fast_response: Optional[requests.Response] = None
+            try:
+                fast_response = self._fast_submit(session, portal_url)
+            except requests.RequestException:
+                pass
+            finally:
+                self._forget_prelogin_routes(session, resolver)
+            if fast_response is not None and fast_response.ok and self.check_internet(session):
+                logger.info("DONE: You are online!")
+                return 0
+            logger.info("Direct login request did not succeed. Falling back to the portal form ...")
+
+        form_attrs, form_inputs = self.parse_form(portal_html, parser)
         payload = self.build_payload(form_inputs, portal_url)
 
-        response = self.submit(session, portal_url, form_attrs, payload)
+        try:
+            response = self.submit(session, portal_url, form_attrs, payload)
+        finally:
+            self._forget_prelogin_routes(session, resolver)
         if response.ok:
-            print("DONE: Login request sent. Rechecking internet access ...")
+            logger.info("DONE: Login request sent. Rechecking internet access ...")
         else:
-            print(f"WARNING: Login request returned HTTP {response.status_code}.")
+            logger.warning("WARNING: Login request returned HTTP %s.", response.status_code)
 
         if self.check_internet(session):
-            print("DONE: You are online!")
+            logger.info("DONE: You are online!")
             return 0
 
-        print("WARNING: Internet still not reachable. Portal may require extra steps.")
+        logger.warning("WARNING: Internet still not reachable. Portal may require extra steps.")
         return 1
@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+"""Stdlib-only connectivity probe for the captive portal login scripts.
+
+Kept apart from captive_portal so the common "already online" run does not
+have to import requests; the portal client is only loaded when needed.
+"""
+
+from __future__ import annotations
+
+import http.client
+import urllib.request
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import IO, Optional
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # A captive portal answers the probe with a redirect; report it as an
+    # HTTPError instead of fetching the portal page here.
+    def redirect_request(
+        self,
+        req: urllib.request.Request,
+        fp: IO[bytes],
+        code: int,
+        msg: str,
+        headers: http.client.HTTPMessage,
+        newurl: str,
+    ) -> Optional[urllib.request.Request]:
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+
+def has_internet_fast(probe_url: str, expected_status: int, timeout: int) -> bool:
+    try:
+        with _opener.open(probe_url, timeout=timeout) as response:
+            return response.status == expected_status
+    except (OSError, http.client.HTTPException):
+        return False
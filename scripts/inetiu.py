@@ -34,6 +34,7 @@ password = "password"
 ### DON'T CHANGE BELOW !!! ###
 
 ### IMPORTS ###
+import logging
 import os
 import pathlib
 import requests
@@ -43,6 +44,8 @@ from requests import adapters
 from urllib3 import poolmanager  # type: ignore[import]
 
 ### GLOBAL VARS ###
+logger = logging.getLogger(__name__)
+
 # urls:
 try_url = "http://www.google.de"    # do not use https site
 host_url = ""                       # e.g.: "https://inetiu4.bundeswehr.de:8443/portal"
@@ -147,50 +150,52 @@ def storeSessionParams(url):
         file.write(token)
 
 def printSessionSummary():          # for debugging only!
-    print("\n++++++++++++++++++++++++++++++++++++++++++++++")
-    print("URLs:")
-    print("try_url: " + try_url)
-    print("host_url: " + host_url)
-    print("portal_url: " + portal_url)
-    print("terms_url: " + terms_url)
-    print("\nSession Params:\n")
-    print("sessionId: " + sessionId)
-    print("portal: " + portal)
-    print("action: " + action)
-    print("token: " + token)
-    print("hidden_value: " + hidden_value)
-    print("++++++++++++++++++++++++++++++++++++++++++++++\n")
+    logger.info("\n++++++++++++++++++++++++++++++++++++++++++++++")
+    logger.info("URLs:")
+    logger.info("try_url: %s", try_url)
+    logger.info("host_url: %s", host_url)
+    logger.info("portal_url: %s", portal_url)
+    logger.info("terms_url: %s", terms_url)
+    logger.info("\nSession Params:\n")
+    logger.info("sessionId: %s", sessionId)
+    logger.info("portal: %s", portal)
+    logger.info("action: %s", action)
+    logger.info("token: %s", token)
+    logger.info("hidden_value: %s", hidden_value)
+    logger.info("++++++++++++++++++++++++++++++++++++++++++++++\n")
 
 def checkLoginResult(response):
     target = "<title>Google</title>"
     result = response.find(target)
     if result > 0:
-        print("DONE: You successfully logged in!")
+        logger.info("DONE: You successfully logged in!")
     else:
-        print("Something went wrong ... you are NOT logged in!")
+        logger.warning("Something went wrong ... you are NOT logged in!")
 
 
 ### START OF SCRIPT ###
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
 # create session:
 session = requests.Session()
 session.mount('https://', TLSAdapter())   # "dh key to small" fix
 r = session.get(try_url)
 logged_in = getLoginState(r.text)
 if logged_in == 0:
-    print("Login to INetiU Captive Portal ...")
+    logger.info("Login to INetiU Captive Portal ...")
     portal_url = getPortalUrl(r.text)
-    print("Portal-URL for manual Login:\n" + portal_url)
+    logger.info("Portal-URL for manual Login:\n%s", portal_url)
     r = session.get(portal_url)
     hidden_value = getHiddenValue(r.text)
 
     # login
-    print("send login data ...")
+    logger.info("send login data ...")
     login_url = getLoginUrl()
     payload_login = {'user.username':user,'user.password':password,'token':hidden_value,'portal':portal}
     r = session.post(login_url,headers=headers,data=payload_login)
 
     # accept terms:
-    print("accept terms ...")
+    logger.info("accept terms ...")
     terms_url = getTermsUrl()
     payload_terms = {'aupAccepted':'true','token':hidden_value}
     r = session.post(terms_url,headers=headers,data=payload_terms)
@@ -201,5 +206,5 @@ if logged_in == 0:
 
     #printSessionSummary()              # for debugging only
 else:
-    print("DONE: You are already logged in! Nothing to do.")
+    logger.info("DONE: You are already logged in! Nothing to do.")
     
@@ -12,9 +12,10 @@
 # request. The configuration at the top should be enough to adapt to other
 # portals (URL, form selector, and required fields).
 
+import logging
 import sys
 
-from captive_portal import CaptivePortalClient
+from connectivity import has_internet_fast
 
 ### CONFIGURATION (edit for other portals) ###
 PROBE_URL = "http://connectivitycheck.gstatic.com/generate_204"
@@ -35,8 +36,18 @@ QUERY_FIELDS_FROM_PORTAL_URL = ["sessionId", "mac", "apMac", "clientMac"]
 
 REQUEST_TIMEOUT = 10
 
+logger = logging.getLogger(__name__)
+
 
 def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
+    if has_internet_fast(PROBE_URL, PROBE_EXPECTED_STATUS, REQUEST_TIMEOUT):
+        logger.info("DONE: Internet is reachable. Nothing to do.")
+        return 0
+
+    from captive_portal import CaptivePortalClient
+
     client = CaptivePortalClient(
         probe_url=PROBE_URL,
         probe_expected_status=PROBE_EXPECTED_STATUS,
@@ -49,7 +60,7 @@ def main() -> int:
         query_fields_from_url=QUERY_FIELDS_FROM_PORTAL_URL,
         request_timeout=REQUEST_TIMEOUT,
     )
-    return client.login()
+    return client.login(probe_first=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "scripts"))
+
+import captive_portal  # noqa: E402
+
+BAYERNWLAN_INIT = (ROOT / "assets" / "BayernWLAN" / "sites" / "init.html").read_text(encoding="utf-8")
+
+BAYERNWLAN_INPUTS = {
+    "loginProfile": "6",
+    "accessType": "termsOnly",
+    "{{operatingMode.queryKey}}": "{{operatingMode.value}}",
+    "sessionID": "{{session.session}}",
+    "action": "redirect",
+    "portal": "bayern",
+}
+
+# The form's parent closes before </form>; browsers keep the input and button in the form.
+BROKEN_NESTING = (
+    '<div><form action="/login"></div>'
+    "<input name=a value=1><button>online gehen</button></form>"
+)
+
+
+@pytest.mark.parametrize("use_lxml", [False, True])
+def test_bayernwlan_init_page(use_lxml):
+    if use_lxml:
+        pytest.importorskip("lxml")
+    form_attrs, form_inputs = captive_portal.parse_login_form(
+        BAYERNWLAN_INIT, "loginForm", "/api/v4/login", use_lxml=use_lxml
+    )
+    assert form_attrs["id"] == "loginForm"
+    assert form_attrs["action"] == "/api/v4/login?"
+    assert form_inputs == BAYERNWLAN_INPUTS
+
+
+def test_bayernwlan_init_page_fed_in_chunks():
+    parser = captive_portal.create_form_parser("loginForm", "/api/v4/login")
+    for start in range(0, len(BAYERNWLAN_INIT), 512):
+        parser.feed(BAYERNWLAN_INIT[start:start + 512])
+        if parser.done:
+            break
+    assert parser.done
+    _, form_inputs = captive_portal.parse_login_form("", "loginForm", "/api/v4/login", parser=parser)
+    assert form_inputs == BAYERNWLAN_INPUTS
+
+
+def test_broken_nesting_keeps_inputs_after_parent_closes():
+    _, form_inputs = captive_portal.parse_login_form(BROKEN_NESTING, None, "login", "online gehen")
+    assert form_inputs == {"a": "1"}
+
+
+def test_default_parser_is_html_parser():
+    parser = captive_portal.create_form_parser(None, "login")
+    assert type(parser) is captive_portal.CaptivePortalFormParser